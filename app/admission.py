@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+
+from fastapi.responses import JSONResponse
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionGate:
+    """Concurrency limit with a bounded wait queue and a queue-time deadline."""
+
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting in the queue if needed. Returns False if rejected."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait({fut}, timeout=self.queue_timeout)
+        except BaseException:
+            # Cancelled while queued: hand back a slot we may have just been given.
+            if fut.done():
+                self.release()
+            else:
+                self._waiters.remove(fut)
+            raise
+        if fut.done():
+            return True  # slot handed over by release()
+        self._waiters.remove(fut)
+        fut.cancel()
+        return False
+
+    def release(self):
+        # Pass the slot straight to the next waiter so queued requests keep FIFO order.
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+
+class TokenBucket:
+    """Shared bytes-per-second budget. A rate of 0 means unlimited."""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+
+    async def consume(self, nbytes: int):
+        if self.rate <= 0 or nbytes <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # Go into debt and sleep it off, so chunks larger than the bucket still pass.
+        self._tokens -= nbytes
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+gates = {
+    "upload": AdmissionGate(
+        "upload", config.UPLOAD_CONCURRENCY, config.UPLOAD_QUEUE_SIZE, config.UPLOAD_QUEUE_TIMEOUT
+    ),
+    "download": AdmissionGate(
+        "download", config.DOWNLOAD_CONCURRENCY, config.DOWNLOAD_QUEUE_SIZE, config.DOWNLOAD_QUEUE_TIMEOUT
+    ),
+    "metadata": AdmissionGate(
+        "metadata", config.METADATA_CONCURRENCY, config.METADATA_QUEUE_SIZE, config.METADATA_QUEUE_TIMEOUT
+    ),
+}
+
+bandwidth = {
+    "upload": TokenBucket(config.UPLOAD_BANDWIDTH),
+    "download": TokenBucket(config.DOWNLOAD_BANDWIDTH),
+}
+
+
+def classify_route(method: str, path: str) -> str:
+    if method == "POST" and path in ("/", "/documents"):
+        return "upload"
+    if method == "GET" and path.startswith("/documents/") and path.endswith("/download"):
+        return "download"
+    return "metadata"
+
+
+class AdmissionControlMiddleware:
+    """Per-route-class admission control with separate upload/download bandwidth.
+
+    Slots are held until the response body has been fully sent, so slow
+    downloads count against the download limit for their whole duration.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify_route(scope["method"], scope["path"])
+        gate = gates[route_class]
+        if not await gate.acquire():
+            logger.warning("Shedding %s %s: %s class at capacity", scope["method"], scope["path"], route_class)
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Server busy, please retry later"},
+                headers={"Retry-After": str(gate.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            bucket = bandwidth.get(route_class)
+            if route_class == "upload" and bucket.rate > 0:
+
+                async def throttled_receive():
+                    message = await receive()
+                    await bucket.consume(len(message.get("body", b"")))
+                    return message
+
+                await self.app(scope, throttled_receive, send)
+            elif route_class == "download" and bucket.rate > 0:
+
+                async def throttled_send(message):
+                    await bucket.consume(len(message.get("body", b"")))
+                    await send(message)
+
+                await self.app(scope, receive, throttled_send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            gate.release()
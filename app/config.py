@@ -20,6 +20,39 @@ DEBUG = os.environ.get("DEBUG", "").lower() in ("1", "true", "yes")
 
 CSRF_SECRET = os.environ.get("CSRF_SECRET") or secrets.token_hex(32)
 
+# Number of characters of extracted text stored as a document preview
+PREVIEW_LENGTH = int(os.environ.get("PREVIEW_LENGTH", "500"))
+
+# Seconds between flushes of buffered per-document access counters to SQLite
+ACCESS_STATS_FLUSH_INTERVAL = float(os.environ.get("ACCESS_STATS_FLUSH_INTERVAL", "10"))
+
+# Request profiling (off by default, requires PROFILING_SECRET). Requests
+# carrying a valid signed X-Profile-Token header are profiled;
+# PROFILING_SAMPLE_RATE additionally profiles a random fraction of requests,
+# keeping the slowest N per route.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILING_SECRET = os.environ.get("PROFILING_SECRET", "")
+PROFILING_DIR = Path(os.environ.get("PROFILING_DIR", str(BASE_DIR / "profiles")))
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_SLOWEST_N = max(1, int(os.environ.get("PROFILING_SLOWEST_N", "5")))
+PROFILING_SAMPLE_INTERVAL = float(os.environ.get("PROFILING_SAMPLE_INTERVAL", "0.005"))
+
+# Admission control: per route class concurrency limit, wait queue size and
+# max seconds a request may wait in the queue before a 503 is returned.
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_QUEUE_SIZE = int(os.environ.get("UPLOAD_QUEUE_SIZE", "16"))
+UPLOAD_QUEUE_TIMEOUT = float(os.environ.get("UPLOAD_QUEUE_TIMEOUT", "10"))
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "16"))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get("DOWNLOAD_QUEUE_SIZE", "64"))
+DOWNLOAD_QUEUE_TIMEOUT = float(os.environ.get("DOWNLOAD_QUEUE_TIMEOUT", "5"))
+METADATA_CONCURRENCY = int(os.environ.get("METADATA_CONCURRENCY", "64"))
+METADATA_QUEUE_SIZE = int(os.environ.get("METADATA_QUEUE_SIZE", "256"))
+METADATA_QUEUE_TIMEOUT = float(os.environ.get("METADATA_QUEUE_TIMEOUT", "1"))
+
+# Shared bandwidth budgets in bytes per second (0 = unlimited)
+UPLOAD_BANDWIDTH = int(os.environ.get("UPLOAD_BANDWIDTH", "0"))
+DOWNLOAD_BANDWIDTH = int(os.environ.get("DOWNLOAD_BANDWIDTH", "0"))
+
 ALLOWED_TYPES = {
     ".pdf": "application/pdf",
     ".txt": "text/plain",
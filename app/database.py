@@ -13,6 +13,34 @@ CREATE TABLE IF NOT EXISTS documents (
 );
 """
 
+# Derived data computed once per upload, off the request path.
+CREATE_PREVIEWS_SQL = """
+CREATE TABLE IF NOT EXISTS document_previews (
+    document_id INTEGER PRIMARY KEY,
+    preview     TEXT,
+    page_count  INTEGER,
+    word_count  INTEGER,
+    sha256      TEXT    NOT NULL
+);
+"""
+
+# Access counters are bucketed per hour so top-N queries can cover a time window.
+CREATE_ACCESS_STATS_SQL = """
+CREATE TABLE IF NOT EXISTS document_access_stats (
+    document_id INTEGER NOT NULL,
+    bucket      TEXT    NOT NULL,
+    downloads   INTEGER NOT NULL DEFAULT 0,
+    views       INTEGER NOT NULL DEFAULT 0,
+    last_access TEXT    NOT NULL,
+    PRIMARY KEY (document_id, bucket)
+);
+"""
+
+CREATE_ACCESS_STATS_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_document_access_stats_bucket
+    ON document_access_stats (bucket);
+"""
+
 
 def get_db() -> sqlite3.Connection:
     conn = sqlite3.connect(str(config.DATABASE_PATH))
@@ -24,6 +52,9 @@ def init_db():
     conn = get_db()
     try:
         conn.execute(CREATE_TABLE_SQL)
+        conn.execute(CREATE_PREVIEWS_SQL)
+        conn.execute(CREATE_ACCESS_STATS_SQL)
+        conn.execute(CREATE_ACCESS_STATS_INDEX_SQL)
         conn.commit()
     finally:
         conn.close()
@@ -42,3 +73,19 @@ def query_documents(page: int, page_size: int) -> tuple[list[dict], int]:
     finally:
         conn.close()
     return [dict(row) for row in rows], total
+
+
+def query_previews(document_ids: list[int]) -> dict[int, dict]:
+    """Return stored previews keyed by document id. Missing ids are not computed yet."""
+    if not document_ids:
+        return {}
+    placeholders = ", ".join("?" * len(document_ids))
+    conn = get_db()
+    try:
+        rows = conn.execute(
+            f"SELECT * FROM document_previews WHERE document_id IN ({placeholders})",
+            document_ids,
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row["document_id"]: dict(row) for row in rows}
@@ -1,4 +1,8 @@
+import asyncio
 import logging
+import random
+import threading
+import time
 import traceback
 from contextlib import asynccontextmanager
 
@@ -6,14 +10,26 @@ from fastapi import FastAPI, Request, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 
 from app import config
+from app.admission import AdmissionControlMiddleware
 from app.database import init_db
 from app.pages import router as pages_router
+from app.previews import backfill_previews
+from app.profiling import (
+    PROFILE_HEADER,
+    UNMATCHED_ROUTE,
+    dump_on_demand,
+    sampler,
+    slowest_requests,
+    wants_profile,
+)
 from app.routes import limiter
 from app.routes import router as api_router
+from app.stats import access_stats, run_flusher
 
 logger = logging.getLogger(__name__)
 
@@ -24,10 +40,26 @@ async def lifespan(app: FastAPI):
         level=getattr(logging, config.LOG_LEVEL, logging.INFO),
         format="%(asctime)s %(levelname)s %(name)s: %(message)s",
     )
+    if config.PROFILING_ENABLED and not config.PROFILING_SECRET:
+        raise RuntimeError("PROFILING_ENABLED requires PROFILING_SECRET to be set")
     config.UPLOAD_DIR.mkdir(exist_ok=True)
     init_db()
+    flusher = asyncio.create_task(run_flusher(config.ACCESS_STATS_FLUSH_INTERVAL))
+    # Documents uploaded before previews existed get them in the background.
+    backfill_stop = threading.Event()
+    backfill = asyncio.create_task(asyncio.to_thread(backfill_previews, backfill_stop))
     logger.info("Document API started")
     yield
+    flusher.cancel()
+    backfill_stop.set()
+    try:
+        await backfill
+    except Exception as e:
+        logger.error("Preview backfill failed: %s", e)
+    try:
+        access_stats.flush()
+    except Exception as e:
+        logger.error("Final access stats flush failed: %s", e)
 
 
 app = FastAPI(title="Document API", lifespan=lifespan)
@@ -37,6 +69,9 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 # --- Middleware ---
 
+# Added first so it sits innermost: shed responses still get security and CORS headers.
+app.add_middleware(AdmissionControlMiddleware)
+
 
 @app.middleware("http")
 async def security_headers(request: Request, call_next):
@@ -48,6 +83,36 @@ async def security_headers(request: Request, call_next):
     return response
 
 
+async def request_profiling(request: Request, call_next):
+    on_demand = wants_profile(request.headers.get(PROFILE_HEADER))
+    sampled = not on_demand and random.random() < config.PROFILING_SAMPLE_RATE
+    if not (on_demand or sampled):
+        return await call_next(request)
+
+    start = time.perf_counter()
+    with sampler.profile(request.scope) as profile:
+        response: Response = await call_next(request)
+    duration = time.perf_counter() - start
+
+    # Unmatched paths share one key so probing random URLs cannot create unbounded files.
+    matched = request.scope.get("route")
+    route = matched.path if matched is not None else UNMATCHED_ROUTE
+    try:
+        if on_demand:
+            path = await asyncio.to_thread(dump_on_demand, profile, request.method, route, duration)
+            response.headers["X-Profile-File"] = path.name
+            logger.info("Profiled %s %s in %.1f ms: %s", request.method, route, duration * 1000, path)
+        else:
+            await asyncio.to_thread(slowest_requests.offer, profile, request.method, route, duration)
+    except Exception as e:
+        logger.error("Failed to write profile for %s %s: %s", request.method, route, e)
+    return response
+
+
+if config.PROFILING_ENABLED:
+    app.add_middleware(BaseHTTPMiddleware, dispatch=request_profiling)
+
+
 if config.CORS_ORIGINS:
     app.add_middleware(
         CORSMiddleware,
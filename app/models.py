@@ -1,12 +1,21 @@
 from pydantic import BaseModel
 
 
+class DocumentPreview(BaseModel):
+    text: str | None
+    page_count: int | None
+    word_count: int | None
+    sha256: str
+
+
 class DocumentMetadata(BaseModel):
     id: int
     filename: str
     size: int
     content_type: str
     upload_timestamp: str
+    # Only set with ?include=preview; None until the preview has been computed
+    preview: DocumentPreview | None = None
 
 
 class DocumentListResponse(BaseModel):
@@ -14,3 +23,16 @@ class DocumentListResponse(BaseModel):
     page: int
     page_size: int
     total: int
+
+
+class DocumentAccessStats(BaseModel):
+    id: int
+    filename: str
+    downloads: int
+    views: int
+    last_access: str
+
+
+class TopDocumentsResponse(BaseModel):
+    documents: list[DocumentAccessStats]
+    hours: int
@@ -2,7 +2,7 @@ import logging
 import math
 import secrets
 
-from fastapi import APIRouter, File, Form, Query, Request, UploadFile
+from fastapi import APIRouter, BackgroundTasks, File, Form, Query, Request, UploadFile
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
@@ -85,6 +85,7 @@ async def index(
 @router.post("/", response_class=HTMLResponse)
 async def index_upload(
     request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     csrf_token: str = Form(""),
 ):
@@ -104,7 +105,7 @@ async def index_upload(
     # Delegate to the API upload handler
     from app.routes import upload_document
     try:
-        await upload_document(request, file)
+        await upload_document(request, background_tasks, file)
     except Exception as e:
         logger.error("Upload failed via UI: %s", e)
         return RedirectResponse("/?msg=err", status_code=303)
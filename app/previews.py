@@ -0,0 +1,303 @@
+import hashlib
+import io
+import logging
+import re
+import threading
+import zipfile
+import zlib
+from html import unescape
+
+from app import config
+from app.database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on decompressed bytes scanned per document. Extraction also
+# stops as soon as PREVIEW_LENGTH characters have been collected.
+MAX_SCAN_BYTES = 1024 * 1024
+MAX_PDF_STREAMS = 4096
+
+_PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+_PDF_PAGES_RE = re.compile(rb"/Type\s*/Pages(?![a-zA-Z])")
+_PDF_COUNT_RE = re.compile(rb"/Count\s+(\d{1,9})")
+_PDF_MAX_PAGES_NODES = 64
+_HEX_DIGITS = frozenset(b"0123456789abcdefABCDEF")
+# Stream dictionaries that never hold page text (images, fonts, xref/object streams)
+_PDF_SKIP_MARKERS = (b"/Image", b"/FontFile", b"/Length1", b"/XRef", b"/ObjStm", b"/Metadata")
+_PDF_ESCAPES = {ord("n"): "\n", ord("r"): "\r", ord("t"): "\t", ord("b"): "\b", ord("f"): "\f"}
+_PDF_TEXT_OPERATORS = {b"Tj", b"TJ", b"'", b'"'}
+# Bounded quantifiers keep each match attempt within one tag, so the scan is linear.
+_DOCX_TOKEN_RE = re.compile(r"<w:t(?: [^<>]{0,256})?>([^<]*)</w:t>|</w:p>")
+_DOCX_PAGES_RE = re.compile(r"<Pages>(\d+)</Pages>")
+_DOCX_WORDS_RE = re.compile(r"<Words>(\d+)</Words>")
+
+
+def _pdf_literal(data: bytes, i: int) -> tuple[str, int]:
+    """Decode the literal string starting after '(' at `i`. Returns (text, end index)."""
+    out = []
+    depth = 1
+    n = len(data)
+    while i < n:
+        c = data[i]
+        if c == 0x5C:  # backslash
+            i += 1
+            if i >= n:
+                break
+            c = data[i]
+            if 0x30 <= c <= 0x37:  # up to three octal digits
+                end = i
+                while end < n and end < i + 3 and 0x30 <= data[end] <= 0x37:
+                    end += 1
+                out.append(chr(int(data[i:end], 8) & 0xFF))
+                i = end
+                continue
+            if c not in (0x0A, 0x0D):  # backslash-newline is a line continuation
+                out.append(_PDF_ESCAPES.get(c, chr(c)))
+        elif c == 0x28:  # (
+            depth += 1
+            out.append("(")
+        elif c == 0x29:  # )
+            depth -= 1
+            if depth == 0:
+                return "".join(out), i + 1
+            out.append(")")
+        else:
+            out.append(chr(c))
+        i += 1
+    return "".join(out), n
+
+
+def _pdf_hex(data: bytes) -> str:
+    """Decode the body of a <...> hex string; a missing final digit counts as 0."""
+    digits = bytes(c for c in data if c in _HEX_DIGITS)
+    if len(digits) % 2:
+        digits += b"0"
+    # Two-byte (CID) strings of ASCII text have a zero high byte
+    return bytes.fromhex(digits.decode()).decode("latin-1").replace("\x00", "")
+
+
+def _pdf_content_text(data: bytes, parts: list[str], limit: int) -> int:
+    """Append text shown by Tj/TJ/'/" operators to `parts`. Returns characters added.
+
+    A single left-to-right pass; no font decoding, so text in custom
+    encodings may come out garbled.
+    """
+    added = 0
+    pending: list[str] = []
+    i = 0
+    n = len(data)
+    while i < n and added < limit:
+        c = data[i]
+        if c == 0x28:  # (
+            text, i = _pdf_literal(data, i + 1)
+            pending.append(text)
+        elif c == 0x3C:  # <
+            if i + 1 < n and data[i + 1] == 0x3C:  # << dictionary start
+                i += 2
+                continue
+            end = data.find(b">", i + 1)
+            if end == -1:
+                break
+            pending.append(_pdf_hex(data[i + 1:end]))
+            i = end + 1
+        elif c == 0x25:  # % comment
+            end = data.find(b"\n", i)
+            i = n if end == -1 else end + 1
+        elif (0x41 <= c <= 0x5A) or (0x61 <= c <= 0x7A) or c in (0x27, 0x22):
+            start = i
+            i += 1
+            while i < n and ((0x41 <= data[i] <= 0x5A) or (0x61 <= data[i] <= 0x7A) or data[i] == 0x2A):
+                i += 1
+            if data[start:i] in _PDF_TEXT_OPERATORS and pending:
+                text = "".join(pending)
+                parts.append(text)
+                added += len(text)
+            pending.clear()
+        else:
+            i += 1
+    return added
+
+
+def _pdf_page_count(content: bytes) -> int | None:
+    """/Count of the last root /Pages node, else the number of /Type /Page objects.
+
+    The last root wins because incremental updates append new versions of
+    objects. Pages inside compressed object streams are not visible here.
+    """
+    nodes = [m.start() for m in _PDF_PAGES_RE.finditer(content)]
+    for pos in reversed(nodes[-_PDF_MAX_PAGES_NODES:]):
+        start = content.rfind(b"obj", max(0, pos - 512), pos)
+        end = content.find(b"endobj", pos, pos + 512)
+        body = content[start if start != -1 else max(0, pos - 512):end if end != -1 else pos + 512]
+        count = _PDF_COUNT_RE.search(body)
+        if count and b"/Parent" not in body:
+            return int(count.group(1))
+    return len(_PDF_PAGE_RE.findall(content)) or None
+
+
+def _pdf_text(content: bytes, limit: int) -> tuple[str, bool]:
+    """Best-effort text from PDF content streams. Returns (text, complete)."""
+    parts: list[str] = []
+    collected = 0
+    budget = MAX_SCAN_BYTES
+    pos = 0
+    for _ in range(MAX_PDF_STREAMS):
+        start = content.find(b"stream", pos)
+        if start == -1:
+            return " ".join(parts), True
+        # Look back at most 256 bytes, and never before the previous stream's end.
+        header = content[max(pos, start - 256):start]
+        data_start = start + len(b"stream")
+        if content.startswith(b"\r\n", data_start):
+            data_start += 2
+        elif content.startswith(b"\n", data_start):
+            data_start += 1
+        end = content.find(b"endstream", data_start)
+        if end == -1:
+            return " ".join(parts), True
+        pos = end + len(b"endstream")
+
+        dict_start = header.rfind(b"obj")
+        stream_dict = header[dict_start:] if dict_start != -1 else header
+        if any(marker in stream_dict for marker in _PDF_SKIP_MARKERS):
+            continue
+        data = content[data_start:end]
+        if b"/FlateDecode" in stream_dict:
+            try:
+                data = zlib.decompressobj().decompress(data, budget)
+            except zlib.error:
+                continue
+        else:
+            data = data[:budget]
+        budget -= len(data)
+
+        collected += _pdf_content_text(data, parts, limit - collected)
+        if collected >= limit or budget <= 0:
+            return " ".join(parts), False
+    return " ".join(parts), False
+
+
+def _docx_text(archive: zipfile.ZipFile, limit: int) -> tuple[str, bool]:
+    """Text of word/document.xml, one line per paragraph. Returns (text, complete)."""
+    with archive.open("word/document.xml") as f:
+        raw = f.read(MAX_SCAN_BYTES + 1)
+    complete = len(raw) <= MAX_SCAN_BYTES
+    xml = raw[:MAX_SCAN_BYTES].decode("utf-8", errors="replace")
+
+    paragraphs: list[str] = []
+    current: list[str] = []
+    collected = 0
+    for match in _DOCX_TOKEN_RE.finditer(xml):
+        if match.group(1) is None:  # end of paragraph
+            paragraphs.append("".join(current))
+            current = []
+            collected += 1
+        else:
+            text = unescape(match.group(1))
+            current.append(text)
+            collected += len(text)
+        if collected >= limit:
+            complete = False
+            break
+    if current:
+        paragraphs.append("".join(current))
+    return "\n".join(paragraphs), complete
+
+
+def extract_preview(content: bytes, content_type: str) -> dict:
+    """Return preview text, page/word counts and SHA-256 for a file's content.
+
+    Counts and preview are None when they cannot be derived from the file.
+    Word counts for PDFs are only given when all of the text was extracted.
+    """
+    limit = config.PREVIEW_LENGTH
+    text = None
+    page_count = None
+    word_count = None
+    try:
+        if content_type == config.ALLOWED_TYPES[".txt"]:
+            text = content.decode("utf-8", errors="replace")
+            word_count = len(text.split())
+        elif content_type == config.ALLOWED_TYPES[".pdf"]:
+            page_count = _pdf_page_count(content)
+            text, complete = _pdf_text(content, limit)
+            if complete and text:
+                word_count = len(text.split())
+        elif content_type == config.ALLOWED_TYPES[".docx"]:
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                text, complete = _docx_text(archive, limit)
+                if complete:
+                    word_count = len(text.split())
+                if "docProps/app.xml" in archive.namelist():
+                    with archive.open("docProps/app.xml") as f:
+                        app_xml = f.read(64 * 1024).decode("utf-8", errors="replace")
+                    pages = _DOCX_PAGES_RE.search(app_xml)
+                    words = _DOCX_WORDS_RE.search(app_xml)
+                    page_count = int(pages.group(1)) if pages else None
+                    if words:
+                        word_count = int(words.group(1))
+    except Exception as e:
+        # Corrupt, encrypted or unsupported files still get a SHA-256.
+        logger.warning("Could not extract text for preview: %s", e)
+        text = None
+        page_count = None
+        word_count = None
+
+    return {
+        "preview": text[:limit] if text else None,
+        "page_count": page_count,
+        "word_count": word_count,
+        "sha256": hashlib.sha256(content).hexdigest(),
+    }
+
+
+def store_preview(document_id: int, content: bytes, content_type: str):
+    """Compute and store derived data for an uploaded document. Runs as a background task."""
+    data = extract_preview(content, content_type)
+    conn = get_db()
+    try:
+        # The document may have been deleted before this task ran.
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO document_previews (document_id, preview, page_count, word_count, sha256)
+            SELECT id, ?, ?, ?, ? FROM documents WHERE id = ?
+            """,
+            (data["preview"], data["page_count"], data["word_count"], data["sha256"], document_id),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info("Stored preview for document id=%d", document_id)
+
+
+def backfill_previews(stop: threading.Event | None = None) -> int:
+    """Compute previews for documents that have none, e.g. uploaded before previews existed.
+
+    Returns the number of documents processed. Checks `stop` between documents.
+    """
+    conn = get_db()
+    try:
+        rows = conn.execute(
+            """
+            SELECT d.id, d.content_type, d.storage_path
+            FROM documents d
+            LEFT JOIN document_previews p ON p.document_id = d.id
+            WHERE p.document_id IS NULL
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+
+    count = 0
+    for row in rows:
+        if stop is not None and stop.is_set():
+            break
+        try:
+            content = (config.UPLOAD_DIR / row["storage_path"]).read_bytes()
+            store_preview(row["id"], content, row["content_type"])
+            count += 1
+        except Exception as e:
+            logger.warning("Preview backfill failed for document id=%d: %s", row["id"], e)
+    if count:
+        logger.info("Backfilled previews for %d documents", count)
+    return count
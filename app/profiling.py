@@ -0,0 +1,227 @@
+import hashlib
+import heapq
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_TOKEN_MAX_AGE = 300  # 5 minutes
+UNMATCHED_ROUTE = "unmatched"
+MAX_SLUG_LENGTH = 64
+
+_SAMPLED_FILE_RE = re.compile(r"^sampled_([A-Z]+)_(.+)_(\d+)ms_\w+\.speedscope\.json$")
+
+
+def _token_serializer() -> URLSafeTimedSerializer:
+    if not config.PROFILING_SECRET:
+        raise RuntimeError("PROFILING_SECRET must be set to use request profiling")
+    return URLSafeTimedSerializer(config.PROFILING_SECRET, salt="profile")
+
+
+def make_profile_token() -> str:
+    """Create a short-lived token that opts a single request into profiling."""
+    return _token_serializer().dumps("profile")
+
+
+def _validate_profile_token(token: str) -> bool:
+    try:
+        _token_serializer().loads(token, max_age=PROFILE_TOKEN_MAX_AGE)
+        return True
+    except (BadSignature, SignatureExpired):
+        return False
+
+
+def wants_profile(token: str | None) -> bool:
+    return (
+        config.PROFILING_ENABLED
+        and bool(config.PROFILING_SECRET)
+        and bool(token)
+        and _validate_profile_token(token)
+    )
+
+
+def _slug(route: str) -> str:
+    slug = re.sub(r"[^\w\-]", "_", route.strip("/")) or "root"
+    if len(slug) > MAX_SLUG_LENGTH:
+        digest = hashlib.sha256(slug.encode()).hexdigest()[:8]
+        slug = f"{slug[:MAX_SLUG_LENGTH - 9]}_{digest}"
+    return slug
+
+
+def _request_stack(frame, scope: dict) -> tuple | None:
+    """Return the stack (root first) if it is running the request owning `scope`.
+
+    Every ASGI layer between the middleware and the endpoint keeps the
+    request's scope dict in a local named `scope`, which identifies the task.
+    """
+    stack = []
+    owned = False
+    while frame is not None:
+        code = frame.f_code
+        if not owned and "scope" in code.co_varnames and frame.f_locals.get("scope") is scope:
+            owned = True
+        stack.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    if not owned:
+        return None
+    stack.reverse()
+    return tuple(stack)
+
+
+class RequestProfile:
+    """Stack samples taken while the event loop was running one request."""
+
+    def __init__(self, scope: dict, thread_id: int):
+        self.scope = scope
+        self.thread_id = thread_id
+        self.samples: list[tuple] = []
+
+    def dump(self, name: str, duration: float) -> Path:
+        """Write the samples in speedscope's sampled-profile format and return the path."""
+        frames: list[dict] = []
+        index: dict[tuple, int] = {}
+        samples = []
+        for stack in self.samples:
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                sample.append(index[frame])
+            samples.append(sample)
+
+        interval = config.PROFILING_SAMPLE_INTERVAL
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "document-api",
+            "name": name,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{name} ({duration * 1000:.1f} ms wall)",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": len(samples) * interval,
+                "samples": samples,
+                "weights": [interval] * len(samples),
+            }],
+        }
+        config.PROFILING_DIR.mkdir(parents=True, exist_ok=True)
+        path = config.PROFILING_DIR / f"{name}.speedscope.json"
+        path.write_text(json.dumps(document))
+        return path
+
+
+class StackSampler:
+    """Samples the event loop thread's stack every PROFILING_SAMPLE_INTERVAL seconds.
+
+    Each sample is kept only by the profiles whose request is on the stack, so
+    concurrent requests do not leak into each other's profiles. While any
+    profile is active, each sample briefly holds the GIL, which adds a little
+    latency to everything on the loop. Time a request spends awaiting I/O or
+    in threadpool workers is not sampled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: list[RequestProfile] = []
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @contextmanager
+    def profile(self, scope: dict):
+        profile = RequestProfile(scope, threading.get_ident())
+        with self._lock:
+            self._active.append(profile)
+            self._wakeup.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        try:
+            yield profile
+        finally:
+            with self._lock:
+                self._active.remove(profile)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(config.PROFILING_SAMPLE_INTERVAL)
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._wakeup.clear()
+                    continue
+            frames = sys._current_frames()
+            for profile in active:
+                stack = _request_stack(frames.get(profile.thread_id), profile.scope)
+                if stack:
+                    profile.samples.append(stack)
+
+
+sampler = StackSampler()
+
+
+def dump_on_demand(profile: RequestProfile, method: str, route: str, duration: float) -> Path:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    return profile.dump(f"{stamp}_{method}_{_slug(route)}_{int(duration * 1000)}ms", duration)
+
+
+class SlowestRequests:
+    """Keeps profiles only for the slowest N sampled requests per route.
+
+    Profiles already in PROFILING_DIR are picked up on first use, so the
+    limit also holds across restarts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # "METHOD_slug" -> min-heap of (duration ms, profile path)
+        self._slowest: dict[str, list[tuple[int, str]]] | None = None
+
+    def _load(self) -> dict[str, list[tuple[int, str]]]:
+        slowest: dict[str, list[tuple[int, str]]] = {}
+        if config.PROFILING_DIR.is_dir():
+            for path in config.PROFILING_DIR.iterdir():
+                match = _SAMPLED_FILE_RE.match(path.name)
+                if match:
+                    key = f"{match.group(1)}_{match.group(2)}"
+                    heapq.heappush(slowest.setdefault(key, []), (int(match.group(3)), str(path)))
+        for heap in slowest.values():
+            while len(heap) > config.PROFILING_SLOWEST_N:
+                _, evicted = heapq.heappop(heap)
+                Path(evicted).unlink(missing_ok=True)
+        return slowest
+
+    def offer(self, profile: RequestProfile, method: str, route: str, duration: float) -> Path | None:
+        key = f"{method}_{_slug(route)}"
+        ms = int(duration * 1000)
+        with self._lock:
+            if self._slowest is None:
+                self._slowest = self._load()
+            heap = self._slowest.setdefault(key, [])
+            if len(heap) >= config.PROFILING_SLOWEST_N and ms <= heap[0][0]:
+                return None
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+            path = profile.dump(f"sampled_{key}_{ms}ms_{stamp}", duration)
+            if len(heap) < config.PROFILING_SLOWEST_N:
+                heapq.heappush(heap, (ms, str(path)))
+            else:
+                _, evicted = heapq.heapreplace(heap, (ms, str(path)))
+                Path(evicted).unlink(missing_ok=True)
+        return path
+
+
+slowest_requests = SlowestRequests()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import re
 from datetime import datetime, timezone
@@ -5,14 +6,22 @@ from pathlib import PurePath
 from uuid import uuid4
 
 import magic
-from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
+from fastapi import APIRouter, BackgroundTasks, File, HTTPException, Query, Request, UploadFile
 from fastapi.responses import FileResponse, Response
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
 from app import config
-from app.database import get_db, query_documents
-from app.models import DocumentListResponse, DocumentMetadata
+from app.database import get_db, query_documents, query_previews
+from app.models import (
+    DocumentAccessStats,
+    DocumentListResponse,
+    DocumentMetadata,
+    DocumentPreview,
+    TopDocumentsResponse,
+)
+from app.previews import store_preview
+from app.stats import MAX_WINDOW_HOURS, access_stats, query_top_documents
 
 logger = logging.getLogger(__name__)
 
@@ -29,9 +38,24 @@ def _sanitize_filename(filename: str) -> str:
     return name
 
 
-@router.post("", response_model=DocumentMetadata, status_code=201)
+def _with_preview(document: DocumentMetadata, previews: dict[int, dict]) -> DocumentMetadata:
+    row = previews.get(document.id)
+    document.preview = DocumentPreview(
+        text=row["preview"],
+        page_count=row["page_count"],
+        word_count=row["word_count"],
+        sha256=row["sha256"],
+    ) if row else None
+    return document
+
+
+@router.post("", response_model=DocumentMetadata, response_model_exclude_unset=True, status_code=201)
 @limiter.limit("30/minute")
-async def upload_document(request: Request, file: UploadFile = File(...)):
+async def upload_document(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+):
     if not file.filename:
         raise HTTPException(status_code=400, detail="Filename is required")
 
@@ -88,6 +112,7 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
         conn.close()
 
     logger.info("Uploaded document id=%d filename=%s size=%d", doc_id, safe_filename, len(content))
+    background_tasks.add_task(store_preview, doc_id, content, content_type)
 
     return DocumentMetadata(
         id=doc_id,
@@ -98,12 +123,13 @@ async def upload_document(request: Request, file: UploadFile = File(...)):
     )
 
 
-@router.get("", response_model=DocumentListResponse)
+@router.get("", response_model=DocumentListResponse, response_model_exclude_unset=True)
 @limiter.limit("60/minute")
 async def list_documents(
     request: Request,
     page: int = Query(1, ge=1),
     page_size: int = Query(10, ge=1, le=100),
+    include: str | None = Query(None, pattern="^preview$"),
 ):
     rows, total = query_documents(page, page_size)
 
@@ -117,15 +143,40 @@ async def list_documents(
         )
         for row in rows
     ]
+    if include == "preview":
+        previews = query_previews([doc.id for doc in documents])
+        documents = [_with_preview(doc, previews) for doc in documents]
 
     return DocumentListResponse(
         documents=documents, page=page, page_size=page_size, total=total
     )
 
 
-@router.get("/{document_id}", response_model=DocumentMetadata)
+@router.get("/stats/top", response_model=TopDocumentsResponse)
+@limiter.limit("60/minute")
+async def top_documents(
+    request: Request,
+    hours: int = Query(24, ge=1, le=MAX_WINDOW_HOURS),
+    limit: int = Query(10, ge=1, le=100),
+):
+    # Include this worker's buffered counters; other workers report on their next flush.
+    try:
+        await asyncio.to_thread(access_stats.flush)
+    except Exception as e:
+        logger.error("Access stats flush failed: %s", e)
+    rows = query_top_documents(hours, limit)
+    return TopDocumentsResponse(
+        documents=[DocumentAccessStats(**row) for row in rows], hours=hours
+    )
+
+
+@router.get("/{document_id}", response_model=DocumentMetadata, response_model_exclude_unset=True)
 @limiter.limit("60/minute")
-async def get_document(request: Request, document_id: int):
+async def get_document(
+    request: Request,
+    document_id: int,
+    include: str | None = Query(None, pattern="^preview$"),
+):
     conn = get_db()
     try:
         row = conn.execute(
@@ -137,13 +188,17 @@ async def get_document(request: Request, document_id: int):
     if row is None:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    return DocumentMetadata(
+    access_stats.record(document_id, "view")
+    document = DocumentMetadata(
         id=row["id"],
         filename=row["filename"],
         size=row["size"],
         content_type=row["content_type"],
         upload_timestamp=row["upload_timestamp"],
     )
+    if include == "preview":
+        document = _with_preview(document, query_previews([document_id]))
+    return document
 
 
 @router.get("/{document_id}/download")
@@ -164,6 +219,7 @@ async def download_document(request: Request, document_id: int):
     if not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found on disk")
 
+    access_stats.record(document_id, "download")
     return FileResponse(
         path=str(file_path),
         media_type=row["content_type"],
@@ -187,9 +243,12 @@ async def delete_document(request: Request, document_id: int):
         file_path.unlink(missing_ok=True)
 
         conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        conn.execute("DELETE FROM document_previews WHERE document_id = ?", (document_id,))
+        conn.execute("DELETE FROM document_access_stats WHERE document_id = ?", (document_id,))
         conn.commit()
     finally:
         conn.close()
 
+    access_stats.discard(document_id)
     logger.info("Deleted document id=%d", document_id)
     return Response(status_code=204)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Longest window /documents/stats/top can query; older buckets are pruned.
+MAX_WINDOW_HOURS = 24 * 90
+PRUNE_INTERVAL = 3600  # seconds
+
+UPSERT_SQL = """
+INSERT INTO document_access_stats (document_id, bucket, downloads, views, last_access)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (document_id, bucket) DO UPDATE SET
+    downloads   = downloads + excluded.downloads,
+    views       = views + excluded.views,
+    last_access = MAX(last_access, excluded.last_access)
+"""
+
+
+def _hour_bucket(ts: datetime) -> str:
+    return ts.replace(minute=0, second=0, microsecond=0).isoformat()
+
+
+class AccessStats:
+    """In-memory per-document access counters, flushed to SQLite in batches.
+
+    Each worker process keeps its own counters; flushes add to the stored
+    totals, so several workers can share one database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (document_id, hour bucket) -> [downloads, views, last_access]
+        self._pending: dict[tuple[int, str], list] = {}
+
+    def record(self, document_id: int, kind: str):
+        now = datetime.now(timezone.utc)
+        key = (document_id, _hour_bucket(now))
+        with self._lock:
+            entry = self._pending.setdefault(key, [0, 0, ""])
+            if kind == "download":
+                entry[0] += 1
+            else:
+                entry[1] += 1
+            entry[2] = now.isoformat()
+
+    def discard(self, document_id: int):
+        with self._lock:
+            for key in [k for k in self._pending if k[0] == document_id]:
+                del self._pending[key]
+
+    def flush(self) -> int:
+        """Write pending counters with a single batched upsert. Returns rows written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        rows = [
+            (doc_id, bucket, downloads, views, last_access)
+            for (doc_id, bucket), (downloads, views, last_access) in pending.items()
+        ]
+        conn = get_db()
+        try:
+            conn.executemany(UPSERT_SQL, rows)
+            conn.commit()
+        except Exception:
+            # Put the counters back so the next flush can retry them.
+            with self._lock:
+                for key, (downloads, views, last_access) in pending.items():
+                    entry = self._pending.setdefault(key, [0, 0, ""])
+                    entry[0] += downloads
+                    entry[1] += views
+                    entry[2] = max(entry[2], last_access)
+            raise
+        finally:
+            conn.close()
+        return len(rows)
+
+
+access_stats = AccessStats()
+
+
+def prune_access_stats(now: datetime | None = None) -> int:
+    """Delete buckets older than the longest queryable window. Returns rows deleted."""
+    now = now or datetime.now(timezone.utc)
+    cutoff = _hour_bucket(now - timedelta(hours=MAX_WINDOW_HOURS))
+    conn = get_db()
+    try:
+        cursor = conn.execute("DELETE FROM document_access_stats WHERE bucket < ?", (cutoff,))
+        conn.commit()
+    finally:
+        conn.close()
+    return cursor.rowcount
+
+
+async def run_flusher(interval: float):
+    """Periodically flush buffered access stats until cancelled, pruning old buckets hourly."""
+    last_prune = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(access_stats.flush)
+        except Exception as e:
+            logger.error("Access stats flush failed: %s", e)
+
+        now = time.monotonic()
+        if last_prune is None or now - last_prune >= PRUNE_INTERVAL:
+            last_prune = now
+            try:
+                deleted = await asyncio.to_thread(prune_access_stats)
+                if deleted:
+                    logger.info("Pruned %d old access stats rows", deleted)
+            except Exception as e:
+                logger.error("Access stats prune failed: %s", e)
+
+
+def query_top_documents(hours: int, limit: int) -> list[dict]:
+    """Return the most-downloaded documents over the last `hours` hours.
+
+    Counters are stored in whole-hour buckets, so the window starts at the
+    beginning of the hour `hours` ago and can cover up to `hours` + 1 hours.
+    """
+    since = _hour_bucket(datetime.now(timezone.utc) - timedelta(hours=hours))
+    conn = get_db()
+    try:
+        rows = conn.execute(
+            """
+            SELECT d.id, d.filename,
+                   SUM(s.downloads) AS downloads,
+                   SUM(s.views) AS views,
+                   MAX(s.last_access) AS last_access
+            FROM document_access_stats s
+            JOIN documents d ON d.id = s.document_id
+            WHERE s.bucket >= ?
+            GROUP BY d.id
+            HAVING SUM(s.downloads) > 0
+            ORDER BY downloads DESC, last_access DESC
+            LIMIT ?
+            """,
+            (since, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
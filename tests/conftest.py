@@ -1,23 +1,42 @@
 import pytest
 from fastapi.testclient import TestClient
+from starlette.middleware.base import BaseHTTPMiddleware
 
 from app import config
 from app.database import init_db
-from app.main import app
+from app.main import app, request_profiling
+from app.routes import limiter
 
 
-@pytest.fixture
-def client(tmp_path, monkeypatch):
+def _configure(tmp_path, monkeypatch):
     monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "test.db")
     upload_dir = tmp_path / "uploads"
     upload_dir.mkdir()
     monkeypatch.setattr(config, "UPLOAD_DIR", upload_dir)
     monkeypatch.setattr(config, "MAX_FILE_SIZE", 10 * 1024 * 1024)
     init_db()
+    limiter.reset()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    _configure(tmp_path, monkeypatch)
     with TestClient(app) as c:
         yield c
 
 
+@pytest.fixture
+def profiling_client(tmp_path, monkeypatch):
+    """Client for the app wrapped in the profiling middleware, as installed when PROFILING_ENABLED is set."""
+    _configure(tmp_path, monkeypatch)
+    monkeypatch.setattr(config, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(config, "PROFILING_SECRET", "test-secret")
+    monkeypatch.setattr(config, "PROFILING_DIR", tmp_path / "profiles")
+    monkeypatch.setattr(config, "PROFILING_SAMPLE_INTERVAL", 0.001)
+    with TestClient(BaseHTTPMiddleware(app, dispatch=request_profiling)) as c:
+        yield c
+
+
 @pytest.fixture
 def sample_pdf():
     return ("test.pdf", b"%PDF-1.4 fake content", "application/pdf")
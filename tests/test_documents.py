@@ -1,6 +1,30 @@
+import asyncio
+import hashlib
 import io
+import json
+import sys
+import time
+import zipfile
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
 
 from app import config
+from app.admission import AdmissionGate, TokenBucket, gates
+from app.database import get_db
+from app.main import app, request_profiling
+from app.previews import MAX_SCAN_BYTES, backfill_previews, extract_preview
+from app.profiling import (
+    RequestProfile,
+    SlowestRequests,
+    _request_stack,
+    _slug,
+    make_profile_token,
+    wants_profile,
+)
+from app.stats import access_stats, prune_access_stats
 
 
 # --- Upload tests ---
@@ -199,3 +223,482 @@ def test_delete_document(client):
 def test_delete_not_found(client):
     response = client.delete("/documents/999")
     assert response.status_code == 404
+
+
+# --- Access stats tests ---
+
+
+def test_top_documents_empty(client):
+    response = client.get("/documents/stats/top")
+    assert response.status_code == 200
+    assert response.json() == {"documents": [], "hours": 24}
+
+
+def test_top_documents_orders_by_downloads(client):
+    _upload_file(client, name="a.txt")
+    _upload_file(client, name="b.txt")
+    client.get("/documents/1/download")
+    for _ in range(3):
+        client.get("/documents/2/download")
+    client.get("/documents/2")
+
+    response = client.get("/documents/stats/top", params={"hours": 1})
+    assert response.status_code == 200
+    docs = response.json()["documents"]
+    assert [d["id"] for d in docs] == [2, 1]
+    assert docs[0]["downloads"] == 3
+    assert docs[0]["views"] == 1
+    assert docs[0]["last_access"]
+
+
+def test_top_documents_excludes_deleted(client):
+    _upload_file(client)
+    client.get("/documents/1/download")
+    client.delete("/documents/1")
+    response = client.get("/documents/stats/top")
+    assert response.json()["documents"] == []
+
+
+def test_top_documents_survives_flush_error(client, monkeypatch):
+    def failing_flush():
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(access_stats, "flush", failing_flush)
+    response = client.get("/documents/stats/top")
+    assert response.status_code == 200
+
+
+def test_access_stats_bucket_index(client):
+    conn = get_db()
+    try:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM document_access_stats WHERE bucket >= ?", ("",)
+        ).fetchall()
+    finally:
+        conn.close()
+    assert any("idx_document_access_stats_bucket" in row["detail"] for row in plan)
+
+
+def test_access_stats_prunes_old_buckets(client):
+    now = datetime(2026, 6, 1, 12, 30, tzinfo=timezone.utc)
+    old = (now - timedelta(days=91)).isoformat()
+    recent = (now - timedelta(days=89)).isoformat()
+    conn = get_db()
+    try:
+        conn.executemany(
+            "INSERT INTO document_access_stats (document_id, bucket, downloads, views, last_access) VALUES (?, ?, 1, 0, ?)",
+            [(1, old, old), (1, recent, recent)],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert prune_access_stats(now) == 1
+    conn = get_db()
+    try:
+        buckets = [row[0] for row in conn.execute("SELECT bucket FROM document_access_stats")]
+    finally:
+        conn.close()
+    assert buckets == [recent]
+
+
+def test_access_stats_buffered_until_flush(client):
+    def stored_downloads():
+        conn = get_db()
+        try:
+            return conn.execute("SELECT SUM(downloads) FROM document_access_stats").fetchone()[0]
+        finally:
+            conn.close()
+
+    _upload_file(client)
+    client.get("/documents/1/download")
+    assert stored_downloads() is None
+
+    access_stats.flush()
+    assert stored_downloads() == 1
+
+
+# --- Profiling tests ---
+
+
+def _enable_profiling(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(config, "PROFILING_SECRET", "test-secret")
+    monkeypatch.setattr(config, "PROFILING_DIR", tmp_path / "profiles")
+    monkeypatch.setattr(config, "PROFILING_SAMPLE_INTERVAL", 0.001)
+
+
+def test_profiling_middleware_not_installed_by_default():
+    assert all(m.kwargs.get("dispatch") is not request_profiling for m in app.user_middleware)
+
+
+def test_profiling_disabled_ignores_token(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILING_SECRET", "test-secret")
+    monkeypatch.setattr(config, "PROFILING_DIR", tmp_path / "profiles")
+    response = client.get("/documents", headers={"X-Profile-Token": make_profile_token()})
+    assert response.status_code == 200
+    assert "x-profile-file" not in response.headers
+    assert not (tmp_path / "profiles").exists()
+
+
+def test_profiling_requires_secret(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "test.db")
+    monkeypatch.setattr(config, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(config, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(config, "PROFILING_SECRET", "")
+    with pytest.raises(RuntimeError, match="PROFILING_SECRET"):
+        with TestClient(app):
+            pass
+    with pytest.raises(RuntimeError, match="PROFILING_SECRET"):
+        make_profile_token()
+    assert not wants_profile("anything")
+
+
+def test_profiling_on_demand_writes_speedscope(profiling_client, tmp_path, monkeypatch):
+    response = profiling_client.get("/documents", headers={"X-Profile-Token": make_profile_token()})
+    assert response.status_code == 200
+    profile_file = tmp_path / "profiles" / response.headers["x-profile-file"]
+    assert "_documents_" in profile_file.name
+    document = json.loads(profile_file.read_text())
+    assert document["profiles"][0]["type"] == "sampled"
+    assert len(document["profiles"][0]["samples"]) == len(document["profiles"][0]["weights"])
+
+
+def test_profiling_token_from_other_secret_rejected(profiling_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILING_SECRET", "other-secret")
+    token = make_profile_token()
+    monkeypatch.setattr(config, "PROFILING_SECRET", "test-secret")
+    response = profiling_client.get("/documents", headers={"X-Profile-Token": token})
+    assert "x-profile-file" not in response.headers
+
+
+def test_profiling_rejects_bad_token(profiling_client, tmp_path, monkeypatch):
+    response = profiling_client.get("/documents", headers={"X-Profile-Token": "forged"})
+    assert response.status_code == 200
+    assert "x-profile-file" not in response.headers
+
+
+def test_profiling_stack_filtered_to_request():
+    def handler(scope):
+        return sys._getframe()
+
+    own_scope, other_scope = {"type": "http"}, {"type": "http"}
+    frame = handler(own_scope)
+    stack = _request_stack(frame, own_scope)
+    assert stack is not None
+    assert stack[-1][0].endswith("handler")
+    assert _request_stack(frame, other_scope) is None
+
+
+def test_profiling_sampling_keeps_slowest_per_route(profiling_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILING_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(config, "PROFILING_SLOWEST_N", 2)
+    monkeypatch.setattr("app.main.slowest_requests", SlowestRequests())
+    _upload_file(profiling_client)
+    for _ in range(4):
+        profiling_client.get("/documents/1")
+
+    names = [p.name for p in (tmp_path / "profiles").iterdir()]
+    assert len([n for n in names if "document_id" in n]) == 2
+
+
+def test_profiling_unmatched_paths_share_one_key(profiling_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILING_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(config, "PROFILING_SLOWEST_N", 2)
+    monkeypatch.setattr("app.main.slowest_requests", SlowestRequests())
+    for i in range(5):
+        assert profiling_client.get(f"/nope{i}").status_code == 404
+
+    names = [p.name for p in (tmp_path / "profiles").iterdir()]
+    assert len(names) == 2
+    assert all(n.startswith("sampled_GET_unmatched_") for n in names)
+
+
+def test_profiling_long_path_does_not_fail_request(profiling_client, tmp_path):
+    response = profiling_client.get("/" + "a" * 300, headers={"X-Profile-Token": make_profile_token()})
+    assert response.status_code == 404
+    assert "unmatched" in response.headers["x-profile-file"]
+
+
+def test_profiling_slug_truncated():
+    slug = _slug("/" + "a" * 300)
+    assert len(slug) <= 64
+    assert slug != _slug("/" + "a" * 299)
+
+
+def test_profiling_write_failure_does_not_fail_request(profiling_client, monkeypatch):
+    def failing_dump(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("app.main.dump_on_demand", failing_dump)
+    response = profiling_client.get("/documents", headers={"X-Profile-Token": make_profile_token()})
+    assert response.status_code == 200
+    assert "x-profile-file" not in response.headers
+
+
+def test_profiling_slowest_prunes_files_from_previous_run(tmp_path, monkeypatch):
+    _enable_profiling(monkeypatch, tmp_path)
+    monkeypatch.setattr(config, "PROFILING_SLOWEST_N", 2)
+    profiles = tmp_path / "profiles"
+    profiles.mkdir()
+    for ms in (1, 2, 3):
+        (profiles / f"sampled_GET_documents_{ms}ms_20260101T000000000000.speedscope.json").write_text("{}")
+
+    slowest = SlowestRequests()
+    path = slowest.offer(RequestProfile({}, 0), "GET", "/documents", 10.0)
+    names = sorted(p.name for p in profiles.iterdir())
+    assert path.name in names
+    assert len(names) == 2
+    assert any("_3ms_" in n for n in names)
+
+
+# --- Admission control tests ---
+
+
+def test_admission_sheds_with_retry_after(client, monkeypatch):
+    monkeypatch.setitem(gates, "upload", AdmissionGate("upload", 0, 0, 2))
+    response = _upload_file(client)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "2"
+    assert response.headers["x-content-type-options"] == "nosniff"
+
+    # Metadata reads are unaffected by a saturated upload class
+    assert client.get("/documents").status_code == 200
+
+
+def test_admission_gate_queue_and_deadline():
+    async def scenario():
+        gate = AdmissionGate("test", limit=1, queue_size=1, queue_timeout=0.05)
+        assert await gate.acquire()
+
+        queued = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert not await gate.acquire()  # queue full: rejected immediately
+
+        gate.release()
+        assert await queued  # slot handed to the queued request
+        assert not await gate.acquire()  # ... which times out in the queue
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_throttles():
+    async def scenario():
+        bucket = TokenBucket(10_000)
+        start = time.monotonic()
+        await bucket.consume(10_000)  # within the initial burst
+        await bucket.consume(2_000)
+        return time.monotonic() - start
+
+    assert asyncio.run(scenario()) >= 0.15
+
+
+# --- Preview tests ---
+
+
+def test_get_document_without_include_has_no_preview(client):
+    _upload_file(client)
+    assert "preview" not in client.get("/documents/1").json()
+    assert "preview" not in client.get("/documents").json()["documents"][0]
+
+
+def test_get_document_include_preview_txt(client):
+    content = b"Hello preview world"
+    _upload_file(client, name="hello.txt", content=content)
+    response = client.get("/documents/1", params={"include": "preview"})
+    assert response.status_code == 200
+    assert response.json()["preview"] == {
+        "text": "Hello preview world",
+        "page_count": None,
+        "word_count": 3,
+        "sha256": hashlib.sha256(content).hexdigest(),
+    }
+
+
+def test_preview_truncated(client, monkeypatch):
+    monkeypatch.setattr(config, "PREVIEW_LENGTH", 5)
+    _upload_file(client, content=b"abcdefghij")
+    preview = client.get("/documents/1", params={"include": "preview"}).json()["preview"]
+    assert preview["text"] == "abcde"
+    assert preview["word_count"] == 1
+
+
+def test_list_documents_include_preview(client):
+    _upload_file(client, name="a.txt", content=b"first file")
+    _upload_file(client, name="b.txt", content=b"second file here")
+    docs = client.get("/documents", params={"include": "preview"}).json()["documents"]
+    assert [d["preview"]["text"] for d in docs] == ["second file here", "first file"]
+
+
+def test_preview_pdf_page_count_and_text(client):
+    content = (
+        b"%PDF-1.4\n1 0 obj << /Type /Pages /Count 2 >> endobj\n"
+        b"2 0 obj << /Type /Page >> endobj\n3 0 obj << /Type /Page >> endobj\n"
+        b"4 0 obj << /Length 30 >>\nstream\nBT (Hello PDF) Tj ET\nendstream\nendobj\n%%EOF"
+    )
+    _upload_file(client, name="doc.pdf", content=content)
+    preview = client.get("/documents/1", params={"include": "preview"}).json()["preview"]
+    assert preview["page_count"] == 2
+    assert preview["text"] == "Hello PDF"
+    assert preview["word_count"] == 2
+
+
+def test_preview_docx(client):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr(
+            "word/document.xml",
+            '<w:document><w:body><w:p><w:r><w:t>Hello</w:t></w:r><w:r><w:t xml:space="preserve"> docx</w:t></w:r></w:p>'
+            "<w:p><w:r><w:t>Second &amp; last</w:t></w:r></w:p></w:body></w:document>",
+        )
+        archive.writestr("docProps/app.xml", "<Properties><Pages>4</Pages></Properties>")
+    _upload_file(client, name="doc.docx", content=buf.getvalue())
+    preview = client.get("/documents/1", params={"include": "preview"}).json()["preview"]
+    assert preview["text"] == "Hello docx\nSecond & last"
+    assert preview["page_count"] == 4
+    assert preview["word_count"] == 5
+
+
+def test_preview_invalid_include(client):
+    response = client.get("/documents", params={"include": "everything"})
+    assert response.status_code == 400
+
+
+PDF_TYPE = config.ALLOWED_TYPES[".pdf"]
+DOCX_TYPE = config.ALLOWED_TYPES[".docx"]
+
+
+def _docx(document_xml, compression=zipfile.ZIP_DEFLATED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression) as archive:
+        archive.writestr("word/document.xml", document_xml)
+    return buf.getvalue()
+
+
+def test_preview_hostile_pdf():
+    hostile = [
+        b"%PDF-1.4\nstream\n" + b"(" * 200_000 + b"\nendstream",
+        b"%PDF-1.4\nstream\n" + b"(" * 200_000,
+        b"%PDF-1.4\n" + b"stream\n" * 100_000,
+        b"%PDF-1.4\n" + b"stream\nendstream" * 200_000,
+        b"%PDF-1.4\nstream\n" + b"[ " * 200_000 + b"\nendstream",
+        # 4 MB of zeros deflated to a few KB
+        b"%PDF-1.4\n1 0 obj << /Filter /FlateDecode >>\nstream\n"
+        + zlib.compress(b"\0" * (4 * 1024 * 1024)) + b"\nendstream",
+        b"%PDF-1.4\n1 0 obj << /Filter /FlateDecode >>\nstream\nnot deflate data\nendstream",
+    ]
+    for content in hostile:
+        data = extract_preview(content, PDF_TYPE)
+        assert data["preview"] is None
+        assert data["word_count"] is None
+        assert data["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+def test_preview_pdf_inflation_capped(monkeypatch):
+    monkeypatch.setattr(config, "PREVIEW_LENGTH", 10**9)
+    stream = zlib.compress(b"BT (ab) Tj ET\n" * (4 * 1024 * 1024 // 14))
+    content = b"%PDF-1.4\n1 0 obj << /Filter /FlateDecode >>\nstream\n" + stream + b"\nendstream"
+    data = extract_preview(content, PDF_TYPE)
+    # Only MAX_SCAN_BYTES of the 4 MB stream is inflated and scanned: at most one word per 14-byte line
+    assert 0 < len(data["preview"].split()) <= MAX_SCAN_BYTES // 14 + 1
+    assert data["word_count"] is None
+
+
+def test_preview_pdf_stops_at_preview_length(monkeypatch):
+    monkeypatch.setattr(config, "PREVIEW_LENGTH", 10)
+    stream = zlib.compress(b"BT (Hello world again and again) Tj ET\n" * 1000)
+    content = b"%PDF-1.4\n1 0 obj << /Filter /FlateDecode >>\nstream\n" + stream + b"\nendstream"
+    data = extract_preview(content, PDF_TYPE)
+    assert data["preview"] == "Hello worl"
+    assert data["word_count"] is None  # text was not fully extracted
+
+
+def test_preview_pdf_hex_strings():
+    content = b"%PDF-1.4\nstream\nBT <48656c6c6f> Tj [<20576f> -20 (rld)] TJ ET\nendstream"
+    data = extract_preview(content, PDF_TYPE)
+    assert data["preview"] == "Hello  World"
+    assert data["word_count"] == 2
+
+
+def test_preview_pdf_page_count_uses_root_pages_count():
+    # Incremental update rewrote page 2, so there are three /Type /Page objects
+    content = (
+        b"%PDF-1.4\n1 0 obj << /Type /Pages /Kids [2 0 R 3 0 R] /Count 2 >> endobj\n"
+        b"2 0 obj << /Type /Page /Parent 1 0 R >> endobj\n3 0 obj << /Type /Page /Parent 1 0 R >> endobj\n"
+        b"%%EOF\n3 0 obj << /Type /Page /Parent 1 0 R /Rotate 90 >> endobj\n%%EOF"
+    )
+    assert extract_preview(content, PDF_TYPE)["page_count"] == 2
+
+
+def test_preview_pdf_page_count_ignores_intermediate_pages_nodes():
+    content = (
+        b"%PDF-1.4\n1 0 obj << /Type /Pages /Kids [2 0 R] /Count 7 >> endobj\n"
+        b"2 0 obj << /Type /Pages /Parent 1 0 R /Kids [] /Count 3 >> endobj\n%%EOF"
+    )
+    assert extract_preview(content, PDF_TYPE)["page_count"] == 7
+
+
+def test_preview_hostile_docx():
+    hostile = [
+        _docx("<w:p " * 1_000_000),
+        _docx("<w:t " * 1_000_000),
+        _docx("<w:p><w:t>" + "x" * 1_000_000),
+    ]
+    for content in hostile:
+        data = extract_preview(content, DOCX_TYPE)
+        assert data["preview"] is None
+        assert data["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+def test_preview_docx_inflation_capped(monkeypatch):
+    monkeypatch.setattr(config, "PREVIEW_LENGTH", 10**9)
+    # 4 MB document.xml; only MAX_SCAN_BYTES of it is read
+    content = _docx("<w:p><w:t>word word</w:t></w:p>" * (4 * 1024 * 1024 // 31))
+    data = extract_preview(content, DOCX_TYPE)
+    assert 0 < len(data["preview"]) <= MAX_SCAN_BYTES
+    assert data["word_count"] is None
+
+
+def test_preview_corrupt_docx_still_stores_sha256(client):
+    content = bytearray(_docx("<w:p><w:t>" + "hello " * 1000 + "</w:t></w:p>"))
+    # Corrupt the deflate data of the only entry, after its local header
+    for i in range(60, 80):
+        content[i] ^= 0xFF
+    content = bytes(content)
+    data = extract_preview(content, DOCX_TYPE)
+    assert data["preview"] is None
+    assert data["sha256"] == hashlib.sha256(content).hexdigest()
+
+    _upload_file(client, name="broken.docx", content=content)
+    preview = client.get("/documents/1", params={"include": "preview"}).json()["preview"]
+    assert preview["sha256"] == hashlib.sha256(content).hexdigest()
+    assert preview["text"] is None
+
+
+def test_preview_unsupported_docx_compression():
+    content = bytearray(_docx("<w:p><w:t>hi</w:t></w:p>", zipfile.ZIP_STORED))
+    # Claim an unknown compression method in both local and central headers
+    for header in (b"PK\x03\x04", b"PK\x01\x02"):
+        offset = content.find(header) + (8 if header == b"PK\x03\x04" else 10)
+        content[offset:offset + 2] = (99).to_bytes(2, "little")
+    data = extract_preview(bytes(content), DOCX_TYPE)
+    assert data["preview"] is None
+    assert data["sha256"]
+
+
+def test_preview_backfill(client):
+    _upload_file(client, content=b"older document")
+    conn = get_db()
+    try:
+        conn.execute("DELETE FROM document_previews")
+        conn.commit()
+    finally:
+        conn.close()
+    assert client.get("/documents/1", params={"include": "preview"}).json()["preview"] is None
+
+    assert backfill_previews() == 1
+    preview = client.get("/documents/1", params={"include": "preview"}).json()["preview"]
+    assert preview["text"] == "older document"
+    assert backfill_previews() == 0